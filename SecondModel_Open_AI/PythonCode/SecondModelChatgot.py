@@ -5,10 +5,11 @@ from dotenv import load_dotenv
 import logging
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
 from openai import OpenAI
 
@@ -28,6 +29,40 @@ class Config:
     max_retries: int = 3
     retry_delay: float = 1.0
     batch_size: int = 10  # Anzahl der Dateien pro Batch
+    chunk_token_budget: int = 1000  # Max. geschätzte Tokens pro Chunk
+    chunk_overlap_tokens: int = 100  # Überlappung zwischen benachbarten Chunks
+    max_parallel_chunks: int = 4  # Anzahl gleichzeitiger API-Anfragen pro E-Mail
+
+
+# Mindestlänge einer Modellantwort (siehe validate_anonymization)
+MIN_OUTPUT_LENGTH = 10
+
+# Grenzen für das Chunking: Zitatzeilen und typische Kopfzeilen weitergeleiteter/beantworteter Mails
+QUOTE_PREFIX = ">"
+THREAD_HEADER_PATTERN = re.compile(
+    r'^\s*(-{2,}\s*(Original|Ursprüngliche|Forwarded|Weitergeleitete)|'
+    r'(Von|From|Gesendet|Sent):\s|Am .+ schrieb|On .+ wrote)',
+    re.IGNORECASE
+)
+
+# Trennstellen für einzelne Zeilen, die das Token-Budget überschreiten (z.B. aus HTML geflachte Mails)
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?;:])\s+')
+WORD_BOUNDARY = re.compile(r'\s+')
+
+
+def estimate_tokens(text: str) -> int:
+    """Grobe Token-Schätzung (ca. 4 Zeichen pro Token)"""
+    return len(text) // 4 + 1
+
+
+def join_units(text: str, units: List[Tuple[int, int]]) -> str:
+    """Fügt Textabschnitte (Zeichenbereiche in text) zeilenweise zusammen"""
+    return "\n".join(text[start:end] for start, end in units).strip()
+
+
+def normalize_whitespace(text: str) -> str:
+    """Fasst Leerraum zusammen, damit zusammengeführte/getrennte Zeilen vergleichbar bleiben"""
+    return " ".join(text.split())
 
 
 # Logging Setup
@@ -124,6 +159,35 @@ Output: "Hallo [GIVENNAME] [SURNAME], Ihre IBAN [IBAN] wurde gespeichert."
             self.logger.warning("Leerer Text übermittelt")
             return text
 
+        if estimate_tokens(text) <= self.config.chunk_token_budget:
+            return self.anonymize_chunk(text)
+
+        units = self.split_into_units(text)
+        chunks = self.split_into_chunks(text, units)
+        self.logger.info(f"Langer Text: Aufteilung in {len(chunks)} Chunks")
+
+        chunk_texts = [join_units(text, units[start:end]) for start, _, end in chunks]
+        with ThreadPoolExecutor(max_workers=self.config.max_parallel_chunks) as executor:
+            results = list(executor.map(self.anonymize_chunk, chunk_texts))
+
+        # Jeder Chunk wurde bereits einzeln wiederholt; scheitert einer endgültig, scheitert der Text
+        for index, result in enumerate(results):
+            if result is None:
+                self.logger.error(f"Chunk {index + 1}/{len(chunks)} konnte nicht anonymisiert werden")
+                return None
+
+        return self.stitch_chunks(text, units, chunks, results)
+
+    def anonymize_chunk(self, text: str) -> Optional[str]:
+        """
+        Anonymisiert einen einzelnen (Teil-)Text mit GPT-4, inkl. Wiederholungen
+
+        Args:
+            text: Der zu anonymisierende (Teil-)Text
+
+        Returns:
+            Anonymisierter Text oder None bei Fehler
+        """
         system_prompt = self.create_system_prompt()
 
         for attempt in range(self.config.max_retries):
@@ -153,6 +217,321 @@ Output: "Hallo [GIVENNAME] [SURNAME], Ihre IBAN [IBAN] wurde gespeichert."
 
         return None
 
+    def split_into_units(self, text: str) -> List[Tuple[int, int]]:
+        """
+        Zerlegt den Text in Zeilen; Zeilen über dem Token-Budget werden weiter aufgeteilt
+
+        Args:
+            text: Originaltext
+
+        Returns:
+            Liste von (start, ende)-Zeichenbereichen in text, ohne Trennzeichen
+        """
+        units = []
+        offset = 0
+        for line in text.split("\n"):
+            end = offset + len(line)
+            if estimate_tokens(line) > self.config.chunk_token_budget:
+                units.extend(self.split_long_line(text, offset, end))
+            else:
+                units.append((offset, end))
+            offset = end + 1
+
+        return units
+
+    def split_long_line(self, text: str, start: int, end: int) -> List[Tuple[int, int]]:
+        """
+        Teilt eine zu lange Zeile an Satzgrenzen, notfalls an Leerzeichen oder hart auf
+
+        Die Teile werden dem Modell als eigene Zeilen übergeben; beim Zusammensetzen wird
+        der ursprüngliche Leerraum zwischen ihnen wiederhergestellt.
+
+        Args:
+            text: Originaltext
+            start: Beginn der Zeile in text
+            end: Ende der Zeile in text
+
+        Returns:
+            Liste von (start, ende)-Zeichenbereichen, jeweils höchstens im Token-Budget
+        """
+        budget = self.config.chunk_token_budget
+        # Kleine Teile, damit sie auch in die Überlappung passen
+        target = self.config.chunk_overlap_tokens or budget
+
+        spans = [(start, end)]
+        for pattern in (SENTENCE_BOUNDARY, WORD_BOUNDARY):
+            split_spans = []
+            for span_start, span_end in spans:
+                if estimate_tokens(text[span_start:span_end]) <= budget:
+                    split_spans.append((span_start, span_end))
+                else:
+                    split_spans.extend(self.pack_spans(text, span_start, span_end, pattern, target))
+            spans = split_spans
+
+        # Einzelne Wörter über dem Budget (z.B. Base64-Blöcke) hart aufteilen
+        max_chars = 4 * max(budget - 1, 1)
+        return [
+            (offset, min(offset + max_chars, span_end))
+            for span_start, span_end in spans
+            for offset in range(span_start, max(span_end, span_start + 1), max_chars)
+        ]
+
+    def pack_spans(self, text: str, start: int, end: int, pattern: re.Pattern,
+                   target: int) -> List[Tuple[int, int]]:
+        """
+        Trennt einen Zeichenbereich an pattern und fasst die Teile bis zu target Tokens zusammen
+
+        Args:
+            text: Originaltext
+            start: Beginn des Bereichs
+            end: Ende des Bereichs
+            pattern: Trennstellen (die Treffer selbst gehören zu keinem Teil)
+            target: Angestrebte maximale Tokenanzahl pro Teil
+
+        Returns:
+            Liste von (start, ende)-Zeichenbereichen
+        """
+        parts = []
+        part_start = start
+        for match in pattern.finditer(text, start, end):
+            parts.append((part_start, match.start()))
+            part_start = match.end()
+        parts.append((part_start, end))
+
+        packed = []
+        for part_start, part_end in parts:
+            if packed and estimate_tokens(text[packed[-1][0]:part_end]) <= target:
+                packed[-1] = (packed[-1][0], part_end)
+            else:
+                packed.append((part_start, part_end))
+
+        return packed
+
+    def split_into_segments(self, text: str, units: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """
+        Zerlegt den Text in Segmente an Absatz- und Zitatgrenzen
+
+        Args:
+            text: Originaltext
+            units: Zeichenbereiche aus split_into_units
+
+        Returns:
+            Liste von (start, ende)-Indizes in units; Leerzeilen hängen am vorherigen Segment
+        """
+        lines = [text[start:end] for start, end in units]
+        segments = []
+        start = 0
+        previous_quoted = None
+
+        for index, line in enumerate(lines):
+            if not line.strip():
+                continue
+
+            quoted = line.lstrip().startswith(QUOTE_PREFIX)
+            after_blank = index > 0 and not lines[index - 1].strip()
+            boundary = (
+                after_blank
+                or (previous_quoted is not None and quoted != previous_quoted)
+                or THREAD_HEADER_PATTERN.match(line) is not None
+            )
+
+            if boundary and index > start:
+                segments.append((start, index))
+                start = index
+            previous_quoted = quoted
+
+        segments.append((start, len(lines)))
+
+        # Zu große Segmente zeilenweise weiter aufteilen (mit Platz für die Überlappung)
+        budget = max(self.config.chunk_token_budget - self.config.chunk_overlap_tokens, 1)
+        result = []
+        for seg_start, seg_end in segments:
+            part_start = seg_start
+            part_tokens = 0
+            for index in range(seg_start, seg_end):
+                line_tokens = estimate_tokens(lines[index])
+                if index > part_start and part_tokens + line_tokens > budget:
+                    result.append((part_start, index))
+                    part_start = index
+                    part_tokens = 0
+                part_tokens += line_tokens
+            result.append((part_start, seg_end))
+
+        return result
+
+    def split_into_chunks(self, text: str, units: List[Tuple[int, int]]) -> List[Tuple[int, int, int]]:
+        """
+        Fasst Segmente zu überlappenden Chunks unter dem Token-Budget zusammen
+
+        Args:
+            text: Originaltext
+            units: Zeichenbereiche aus split_into_units
+
+        Returns:
+            Liste von (start, neuer_start, ende)-Indizes in units; [start, neuer_start)
+            ist die Überlappung mit dem vorherigen Chunk
+        """
+        segments = self.split_into_segments(text, units)
+
+        def chunk_tokens(start: int, end: int) -> int:
+            return estimate_tokens(join_units(text, units[start:end]))
+
+        chunks = []
+        first = 0
+        while first < len(segments):
+            new_start = segments[first][0]
+
+            # Überlappung: letzte Zeilen vor dem Chunk, solange sie ins Overlap-Budget passen
+            # (zeilenweise, damit auch große Absätze eine Überlappung bekommen)
+            start = new_start
+            overlap_tokens = 0
+            if chunks:
+                previous_new_start = chunks[-1][1]
+                while start > previous_new_start:
+                    unit_start, unit_end = units[start - 1]
+                    unit_tokens = estimate_tokens(text[unit_start:unit_end])
+                    if overlap_tokens + unit_tokens > self.config.chunk_overlap_tokens:
+                        break
+                    start -= 1
+                    overlap_tokens += unit_tokens
+
+            # Überlappung kürzen, falls sie zusammen mit dem ersten Segment das Budget sprengt
+            while start < new_start and chunk_tokens(start, segments[first][1]) > self.config.chunk_token_budget:
+                start += 1
+
+            # Neue Segmente anhängen, solange das Budget reicht (mindestens eines)
+            last = first + 1
+            while last < len(segments) and chunk_tokens(start, segments[last][1]) <= self.config.chunk_token_budget:
+                last += 1
+
+            chunks.append((start, new_start, segments[last - 1][1]))
+            first = last
+
+        # Zu kurze Chunks (z.B. nur eine Grußformel ohne Überlappung) würden die Validierung
+        # nie bestehen und werden mit einem Nachbarn zusammengelegt
+        index = 0
+        while len(chunks) > 1 and index < len(chunks):
+            start, _, end = chunks[index]
+            if len(join_units(text, units[start:end])) >= MIN_OUTPUT_LENGTH:
+                index += 1
+                continue
+
+            index = max(index - 1, 0)
+            first_start, first_new_start, _ = chunks[index]
+            chunks[index:index + 2] = [(first_start, first_new_start, chunks[index + 1][2])]
+
+        return chunks
+
+    def stitch_chunks(self, text: str, units: List[Tuple[int, int]],
+                      chunks: List[Tuple[int, int, int]], results: List[str]) -> str:
+        """
+        Setzt die anonymisierten Chunks wieder zusammen und entfernt doppelte Überlappungen
+
+        Die Überlappung wird nur entfernt, wenn sie eindeutig zugeordnet werden kann
+        (siehe find_overlap); andernfalls bleibt sie doppelt erhalten, damit kein Text
+        verloren geht. Behält das Modell die Zeilenstruktur bei, wird der ursprüngliche
+        Leerraum zwischen den Zeilen exakt wiederhergestellt.
+
+        Args:
+            text: Originaltext
+            units: Zeichenbereiche aus split_into_units
+            chunks: Chunk-Grenzen aus split_into_chunks
+            results: Anonymisierte Chunks in gleicher Reihenfolge
+
+        Returns:
+            Zusammengesetzter anonymisierter Text
+        """
+        pieces = []
+
+        for index, ((start, new_start, end), result) in enumerate(zip(chunks, results)):
+            result_lines = [line for line in result.split("\n") if line.strip()]
+
+            drop = 0
+            if index > 0:
+                drop = self.find_overlap(text, units, chunks[index - 1], results[index - 1],
+                                         (start, new_start, end), result)
+                if new_start > start and not drop:
+                    self.logger.warning("Überlappung nicht eindeutig gefunden, Zeilen bleiben doppelt erhalten")
+
+            # Zeichenbereich des Originals, den dieser Chunk abdeckt (inkl. Leerraum bis zum nächsten)
+            region_start = units[new_start][0]
+            region_end = units[end][0] if end < len(units) else len(text)
+            region_units = [
+                (unit_start, unit_end) for unit_start, unit_end in units[new_start:end]
+                if text[unit_start:unit_end].strip()
+            ]
+            remainder = result_lines[drop:]
+
+            if len(remainder) != len(region_units):
+                self.logger.warning("Zeilenstruktur vom Modell verändert, Leerraum wird nicht exakt übernommen")
+                region_text = text[region_start:region_end]
+                leading = region_text[:len(region_text) - len(region_text.lstrip())]
+                trailing = region_text[len(region_text.rstrip()):] if region_text.strip() else ""
+                pieces.append(leading + "\n".join(remainder).strip() + trailing)
+                continue
+
+            # Zeilen des Modells mit dem Leerraum des Originals verbinden
+            position = region_start
+            for (unit_start, unit_end), line in zip(region_units, remainder):
+                unit = text[unit_start:unit_end]
+                content_start = unit_start + len(unit) - len(unit.lstrip())
+                pieces.append(text[position:content_start] + line.strip())
+                position = unit_start + len(unit.rstrip())
+            pieces.append(text[position:region_end])
+
+        return "".join(pieces)
+
+    def find_overlap(self, text: str, units: List[Tuple[int, int]],
+                     previous_chunk: Tuple[int, int, int], previous_result: str,
+                     chunk: Tuple[int, int, int], result: str) -> int:
+        """
+        Bestimmt, wie viele Zeilen am Anfang eines Chunks die Überlappung wiedergeben
+
+        Die Überlappung wird nur verworfen, wenn mindestens einer der beiden Chunks
+        seine Zeilenanzahl behalten hat: dann steht fest, welche Zeilen dort genau den
+        Überlappungszeilen des Originals entsprechen. Die Gegenseite muss (bis auf
+        Leerraum, also auch bei zusammengeführten/getrennten Zeilen) denselben Text
+        liefern. So kann der Abgleich nie in neue Zeilen hineinreichen, auch nicht bei
+        wiederholten Blöcken.
+
+        Args:
+            text: Originaltext
+            units: Zeichenbereiche aus split_into_units
+            previous_chunk: Grenzen des vorherigen Chunks
+            previous_result: Anonymisierter vorheriger Chunk
+            chunk: Grenzen des aktuellen Chunks
+            result: Anonymisierter aktueller Chunk
+
+        Returns:
+            Anzahl der zu verwerfenden nicht-leeren Zeilen aus result (0 wenn unklar)
+        """
+        def count_content(start: int, end: int) -> int:
+            return sum(1 for unit_start, unit_end in units[start:end] if text[unit_start:unit_end].strip())
+
+        previous_start, _, previous_end = previous_chunk
+        start, new_start, end = chunk
+        overlap_count = count_content(start, new_start)
+        if not overlap_count:
+            return 0
+
+        tail = [line for line in previous_result.split("\n") if line.strip()]
+        head = [line for line in result.split("\n") if line.strip()]
+        previous_kept = len(tail) == count_content(previous_start, previous_end)
+        current_kept = len(head) == count_content(start, end)
+        if not previous_kept and not current_kept:
+            return 0
+
+        head_counts = [overlap_count] if current_kept else range(1, len(head) + 1)
+        tail_counts = [overlap_count] if previous_kept else range(1, len(tail) + 1)
+        tail_texts = {
+            normalize_whitespace(" ".join(tail[-j:])) for j in tail_counts if j <= len(tail)
+        }
+        for k in head_counts:
+            if k <= len(head) and normalize_whitespace(" ".join(head[:k])) in tail_texts:
+                return k
+
+        return 0
+
     def validate_anonymization(self, original: str, anonymized: str) -> bool:
         """
         Validiert die Anonymisierung
@@ -165,7 +544,7 @@ Output: "Hallo [GIVENNAME] [SURNAME], Ihre IBAN [IBAN] wurde gespeichert."
             True wenn Validierung erfolgreich
         """
         # Grundlegende Validierung
-        if not anonymized or len(anonymized) < 10:
+        if not anonymized or len(anonymized) < MIN_OUTPUT_LENGTH:
             return False
 
         # Prüfe ob Labels verwendet wurden
@@ -0,0 +1,209 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from SecondModelChatgot import Config, EmailAnonymizer, estimate_tokens
+
+ORIGINAL_EMAILS = Path(__file__).resolve().parents[2] / "TestingData" / "AllOriginalEmails"
+
+
+class StubCompletions:
+    """Ersetzt client.chat.completions und wendet transform auf den User-Text an"""
+
+    def __init__(self, transform):
+        self.transform = transform
+        self.calls = []
+
+    def create(self, model, messages, temperature):
+        text = messages[1]["content"]
+        self.calls.append(text)
+        content = self.transform(text)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def make_anonymizer(tmp_path, monkeypatch, transform, **overrides):
+    monkeypatch.chdir(tmp_path)
+    config = Config(
+        input_folder=tmp_path / "input",
+        output_folder=tmp_path / "output",
+        api_key="test",
+        retry_delay=0,
+        **overrides
+    )
+    anonymizer = EmailAnonymizer(config)
+    completions = StubCompletions(transform)
+    anonymizer.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return anonymizer, completions
+
+
+def paragraphs(count, lines_per_paragraph=3):
+    return "\n\n".join(
+        "\n".join(f"Absatz {p} Zeile {l}: Kunde Max Mustermann, Vertrag {p}{l}" for l in range(lines_per_paragraph))
+        for p in range(count)
+    )
+
+
+def meter_readings(count):
+    return "\n\n".join(
+        "Zählerstand: [METER_AMOUNT]\nZählernummer: [METER_NUMBER]\nDatum: [DATE]\nKunde: [GIVENNAME] [SURNAME]"
+        for _ in range(count)
+    )
+
+
+def chunk_bounds(anonymizer, text):
+    return anonymizer.split_into_chunks(text, anonymizer.split_into_units(text))
+
+
+def merge_first_two_lines(text):
+    lines = text.split("\n")
+    return "\n".join([lines[0] + " " + lines[1]] + lines[2:])
+
+
+def split_first_line(text):
+    lines = text.split("\n")
+    first, rest = lines[0].split(": ", 1)
+    return "\n".join([first + ":", rest] + lines[1:])
+
+
+def test_short_text_is_not_chunked(tmp_path, monkeypatch):
+    anonymizer, completions = make_anonymizer(tmp_path, monkeypatch, lambda text: text)
+    text = paragraphs(2)
+
+    assert anonymizer.anonymize_text(text) == text
+    assert completions.calls == [text]
+
+
+def test_identity_output_reproduces_input(tmp_path, monkeypatch):
+    anonymizer, completions = make_anonymizer(
+        tmp_path, monkeypatch, lambda text: text,
+        chunk_token_budget=200, chunk_overlap_tokens=40
+    )
+    text = (
+        "\n  " + paragraphs(10) + "\n\n\n   \n" + paragraphs(10).replace("\n", "\n    ")
+        + "\t\n\nAm 01.01.2025 schrieb Max:\n> Zitat eins\n> Zitat zwei\n\nGruß\n\n"
+    )
+
+    assert anonymizer.anonymize_text(text) == text
+    assert len(completions.calls) > 1
+
+
+def test_overlap_is_deduplicated(tmp_path, monkeypatch):
+    anonymizer, _ = make_anonymizer(
+        tmp_path, monkeypatch, lambda text: text.replace("Max Mustermann", "[GIVENNAME] [SURNAME]"),
+        chunk_token_budget=200, chunk_overlap_tokens=40
+    )
+    text = paragraphs(20)
+    chunks = chunk_bounds(anonymizer, text)
+
+    assert all(start < new_start for start, new_start, _ in chunks[1:])
+    assert anonymizer.anonymize_text(text) == text.replace("Max Mustermann", "[GIVENNAME] [SURNAME]")
+
+
+def test_long_block_without_blank_lines_gets_overlap(tmp_path, monkeypatch):
+    anonymizer, _ = make_anonymizer(tmp_path, monkeypatch, lambda text: text)
+    text = "\n".join(f"Zeile {i}: " + "x" * 50 for i in range(150))
+    chunks = chunk_bounds(anonymizer, text)
+
+    assert len(chunks) > 1
+    assert all(start < new_start for start, new_start, _ in chunks[1:])
+    assert anonymizer.anonymize_text(text) == text
+
+
+def test_short_trailing_segment(tmp_path, monkeypatch):
+    anonymizer, _ = make_anonymizer(tmp_path, monkeypatch, lambda text: text)
+    text = "x" * 3995 + "\n\n" + "x" * 3995 + "\n\nCiao"
+
+    assert anonymizer.anonymize_text(text) == text
+
+
+def test_short_middle_segment(tmp_path, monkeypatch):
+    anonymizer, completions = make_anonymizer(tmp_path, monkeypatch, lambda text: text)
+    text = "x" * 3995 + "\n\nDanke\n\n" + "y" * 3995
+
+    assert anonymizer.anonymize_text(text) == text
+    assert all(len(call) >= 10 for call in completions.calls)
+
+
+def test_repeated_blocks_are_not_dropped(tmp_path, monkeypatch):
+    anonymizer, _ = make_anonymizer(
+        tmp_path, monkeypatch, lambda text: text,
+        chunk_token_budget=200, chunk_overlap_tokens=40
+    )
+    text = meter_readings(40)
+
+    assert anonymizer.anonymize_text(text) == text
+
+
+@pytest.mark.parametrize("transform", [merge_first_two_lines, split_first_line])
+def test_changed_lines_with_repeated_blocks_do_not_lose_text(tmp_path, monkeypatch, transform):
+    anonymizer, _ = make_anonymizer(
+        tmp_path, monkeypatch, transform,
+        chunk_token_budget=200, chunk_overlap_tokens=40
+    )
+    text = meter_readings(40)
+
+    result = anonymizer.anonymize_text(text)
+
+    assert result.count("Zählerstand:") >= 40
+    assert result.count("Kunde:") >= 40
+
+
+@pytest.mark.parametrize("separator", [" ", ""])
+def test_long_single_line_is_split_under_budget(tmp_path, monkeypatch, separator):
+    anonymizer, completions = make_anonymizer(tmp_path, monkeypatch, lambda text: text)
+    sentence = "Der Kunde Max Mustermann meldet den Zählerstand für Vertrag 4711." if separator else "x"
+    text = separator.join([sentence] * (40000 // len(sentence)))
+
+    assert anonymizer.anonymize_text(text) == text
+    assert len(completions.calls) > 1
+    assert all(estimate_tokens(call) <= anonymizer.config.chunk_token_budget for call in completions.calls)
+
+
+def test_original_emails_whitespace_is_preserved(tmp_path, monkeypatch):
+    anonymizer, _ = make_anonymizer(
+        tmp_path, monkeypatch, lambda text: text,
+        chunk_token_budget=60, chunk_overlap_tokens=15
+    )
+    texts = [path.read_text(encoding="utf-8") for path in sorted(ORIGINAL_EMAILS.glob("*.txt"))]
+    chunked = [text for text in texts if estimate_tokens(text) > anonymizer.config.chunk_token_budget]
+
+    assert chunked
+    for text in chunked:
+        assert anonymizer.anonymize_text(text) == text
+
+
+@pytest.mark.parametrize("transform", [merge_first_two_lines, split_first_line])
+def test_changed_lines_in_overlap_do_not_lose_text(tmp_path, monkeypatch, transform):
+    anonymizer, _ = make_anonymizer(
+        tmp_path, monkeypatch, transform,
+        chunk_token_budget=200, chunk_overlap_tokens=40
+    )
+    text = paragraphs(40)
+
+    result = anonymizer.anonymize_text(text)
+
+    normalized_result = " ".join(result.split())
+    for line in text.split("\n"):
+        if line.strip():
+            assert line in normalized_result
+
+
+def test_only_failed_chunk_is_retried(tmp_path, monkeypatch):
+    failed = set()
+
+    def fail_once(text):
+        if "Absatz 10 " in text and text not in failed:
+            failed.add(text)
+            raise RuntimeError("API-Fehler")
+        return text
+
+    anonymizer, completions = make_anonymizer(
+        tmp_path, monkeypatch, fail_once,
+        chunk_token_budget=200, chunk_overlap_tokens=40
+    )
+    text = paragraphs(20)
+    chunk_count = len(chunk_bounds(anonymizer, text))
+
+    assert anonymizer.anonymize_text(text) == text
+    assert len(completions.calls) == chunk_count + len(failed)